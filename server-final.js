@@ -1,26 +1,49 @@
 const express = require('express');
 const path = require('path');
 const https = require('https');
+const fs = require('fs');
+const zlib = require('zlib');
+const crypto = require('crypto');
+const { performance } = require('perf_hooks');
 
 const app = express();
 // ✅ ИСПРАВЛЕНО: используем порт 10000 как в логах
 const PORT = process.env.PORT || 10000;
 
 // Middleware
-app.use(express.json());
-app.use(express.static('.'));
+// Ни один endpoint не ждет больших тел: лишнее отклоняется по Content-Length (413) до парсинга
+app.use(express.json({ limit: '10kb' }));
+// index: false — корневую страницу отдает кэширующий обработчик ниже
+app.use(express.static('.', { index: false }));
 
 // ElevenLabs configuration
 const ELEVENLABS_API_KEY = process.env.ELEVENLABS_API_KEY || 'sk_95a5725ca01fdba20e15bd662d8b76152971016ff045377f';
 const AGENT_ID = process.env.AGENT_ID || 'agent_01jzwcew2ferttga9m1zcn3js1';
 
+// Общий keep-alive агент для всех запросов к ElevenLabs: TCP+TLS соединения переиспользуются
+const elevenLabsAgent = new https.Agent({
+  keepAlive: true,
+  maxSockets: 50,
+  maxFreeSockets: 10,
+  // Мелкие запросы к API не должны ждать алгоритма Нейгла — задаём явно, не полагаясь на дефолт Node
+  noDelay: true
+});
+
 console.log(`🎯 Server starting with Agent ID: ${AGENT_ID}`);
 console.log(`🔑 API Key configured: ${ELEVENLABS_API_KEY ? 'Yes' : 'No'}`);
 
+// Подробные логи (заголовки и тела ответов ElevenLabs, health пробы): VERBOSE_LOGS=true
+const VERBOSE_LOGS = process.env.VERBOSE_LOGS === 'true';
+
+// Пути частых проб, которые не пишем в лог каждого запроса
+const QUIET_PATHS = new Set(['/health', '/favicon.ico']);
+
 // Enhanced logging middleware
 app.use((req, res, next) => {
-  const timestamp = new Date().toISOString();
-  console.log(`[${timestamp}] ${req.method} ${req.path} - ${req.ip}`);
+  if (VERBOSE_LOGS || !QUIET_PATHS.has(req.path)) {
+    const timestamp = new Date().toISOString();
+    console.log(`[${timestamp}] ${req.method} ${req.path} - ${req.ip}`);
+  }
   next();
 });
 
@@ -66,28 +89,82 @@ app.get('/api/agent-id', async (req, res) => {
   }
 });
 
+// Ошибка ответа ElevenLabs с машинно-читаемым статусом (unauthorized, timeout, ...)
+class ElevenLabsError extends Error {
+  constructor(message, status) {
+    super(message);
+    this.name = 'ElevenLabsError';
+    this.status = status;
+  }
+}
+
+// HTTP код и описание для клиента по статусу ElevenLabsError
+const ERROR_RESPONSES = {
+  unauthorized: { statusCode: 401, details: 'Invalid API key or insufficient permissions' },
+  agent_not_found: { statusCode: 404, details: 'Agent ID not found in ElevenLabs' },
+  rate_limited: { statusCode: 429, details: 'API rate limit exceeded' },
+  timeout: { statusCode: 504, details: 'ElevenLabs API timeout' }
+};
+
+// Одновременные одинаковые проверки делят один запрос к ElevenLabs вместо N параллельных
+function singleFlight(requestFn) {
+  let inFlight = null;
+  return () => {
+    if (!inFlight) {
+      inFlight = requestFn().finally(() => {
+        inFlight = null;
+      });
+    }
+    return inFlight;
+  };
+}
+
+const checkAgentExists = singleFlight(requestAgentExists);
+const checkElevenLabsAPI = singleFlight(requestElevenLabsAPI);
+
+// Signed URL у ElevenLabs действует ~15 минут — новые сессии получают уже выданный,
+// с запасом до истечения, вместо HTTPS-запроса на каждое подключение
+const SIGNED_URL_TTL_MS = 4 * 60 * 1000;
+let signedUrlCache = null;
+
+const fetchSignedUrl = singleFlight(async () => {
+  const url = await getSignedUrl();
+  signedUrlCache = { url, expiresAt: performance.now() + SIGNED_URL_TTL_MS };
+  return url;
+});
+
+function getCachedSignedUrl() {
+  if (signedUrlCache && performance.now() < signedUrlCache.expiresAt) {
+    return Promise.resolve(signedUrlCache.url);
+  }
+  return fetchSignedUrl();
+}
+
 // ✅ ИСПРАВЛЕНА КРИТИЧЕСКАЯ ОШИБКА: правильный endpoint для проверки агента
-function checkAgentExists() {
-  return new Promise((resolve, reject) => {
-    const options = {
-      hostname: 'api.elevenlabs.io',
-      port: 443,
-      // ✅ ИСПРАВЛЕНО: используем правильный endpoint из документации
-      path: `/v1/convai/agents/${AGENT_ID}`,
-      method: 'GET',
-      headers: {
-        'xi-api-key': ELEVENLABS_API_KEY,
-        'User-Agent': 'ElevenLabs-Voice-Chat/2.1',
-        'Accept': 'application/json'
-      },
-      timeout: 10000
-    };
+// Параметры запросов к ElevenLabs постоянны — собираются один раз при старте
+const AGENT_CHECK_REQUEST = Object.freeze({
+  hostname: 'api.elevenlabs.io',
+  port: 443,
+  agent: elevenLabsAgent,
+  // ✅ ИСПРАВЛЕНО: используем правильный endpoint из документации
+  path: `/v1/convai/agents/${AGENT_ID}`,
+  method: 'GET',
+  headers: {
+    'xi-api-key': ELEVENLABS_API_KEY,
+    'User-Agent': 'ElevenLabs-Voice-Chat/2.1',
+    'Accept': 'application/json'
+  },
+  timeout: 10000
+});
 
-    const req = https.request(options, (res) => {
-      let data = '';
+function requestAgentExists() {
+  return new Promise((resolve, reject) => {
+    const req = https.request(AGENT_CHECK_REQUEST, (res) => {
+      // Буферы собираются без конкатенации строк; тело декодируется только если оно нужно
+      const chunks = [];
       
       res.on('data', (chunk) => {
-        data += chunk;
+        chunks.push(chunk);
       });
       
       res.on('end', () => {
@@ -101,8 +178,9 @@ function checkAgentExists() {
           resolve(false);
         } else if (res.statusCode === 401) {
           console.log('❌ Unauthorized - check API key');
-          reject(new Error('Unauthorized access to agent'));
+          reject(new ElevenLabsError('Unauthorized access to agent', 'unauthorized'));
         } else {
+          const data = Buffer.concat(chunks).toString('utf8');
           console.log(`⚠️ Unexpected status: ${res.statusCode}`);
           console.log('Response:', data);
           reject(new Error(`API returned ${res.statusCode}: ${data}`));
@@ -118,7 +196,7 @@ function checkAgentExists() {
     req.on('timeout', () => {
       console.log('⏰ Agent check timeout');
       req.destroy();
-      reject(new Error('Request timeout'));
+      reject(new ElevenLabsError('Request timeout', 'timeout'));
     });
 
     req.end();
@@ -130,11 +208,18 @@ app.get('/api/signed-url', async (req, res) => {
   console.log('🔐 Signed URL requested');
   
   try {
-    // Сначала проверяем что агент существует
-    console.log('Checking agent availability before signed URL...');
-    const agentExists = await checkAgentExists();
+    // Проверка агента и запрос signed URL идут параллельно
+    console.log('Checking agent availability and requesting signed URL...');
+    const [agentCheck, signedUrlResult] = await Promise.allSettled([
+      checkAgentExists(),
+      getCachedSignedUrl()
+    ]);
+    
+    if (agentCheck.status === 'rejected') {
+      throw agentCheck.reason;
+    }
     
-    if (!agentExists) {
+    if (!agentCheck.value) {
       console.log('❌ Agent not found, cannot create signed URL');
       return res.status(404).json({
         error: 'Agent not found',
@@ -146,7 +231,11 @@ app.get('/api/signed-url', async (req, res) => {
       });
     }
     
-    const signedUrl = await getSignedUrl();
+    if (signedUrlResult.status === 'rejected') {
+      throw signedUrlResult.reason;
+    }
+    
+    const signedUrl = signedUrlResult.value;
     console.log('✅ Signed URL obtained successfully');
     
     res.json({
@@ -159,28 +248,11 @@ app.get('/api/signed-url', async (req, res) => {
   } catch (error) {
     console.error('❌ Signed URL error:', error.message);
     
-    // Более детальная обработка ошибок
-    let errorDetails = error.message;
-    let statusCode = 500;
-    let status = 'error';
-    
-    if (error.message.includes('Unauthorized')) {
-      statusCode = 401;
-      status = 'unauthorized';
-      errorDetails = 'Invalid API key or insufficient permissions';
-    } else if (error.message.includes('Agent not found')) {
-      statusCode = 404;
-      status = 'agent_not_found';
-      errorDetails = 'Agent ID not found in ElevenLabs';
-    } else if (error.message.includes('Rate limit')) {
-      statusCode = 429;
-      status = 'rate_limited';
-      errorDetails = 'API rate limit exceeded';
-    } else if (error.message.includes('timeout')) {
-      statusCode = 504;
-      status = 'timeout';
-      errorDetails = 'ElevenLabs API timeout';
-    }
+    // Более детальная обработка ошибок: по типу ошибки, а не по тексту сообщения
+    const status = error instanceof ElevenLabsError ? error.status : 'error';
+    const errorResponse = ERROR_RESPONSES[status];
+    const statusCode = errorResponse ? errorResponse.statusCode : 500;
+    const errorDetails = errorResponse ? errorResponse.details : error.message;
     
     res.status(statusCode).json({
       error: 'Signed URL failed',
@@ -231,38 +303,45 @@ function getErrorRecommendations(status) {
 }
 
 // ✅ ИСПРАВЛЕНА КРИТИЧЕСКАЯ ОШИБКА: используем правильный endpoint
+const SIGNED_URL_REQUEST = Object.freeze({
+  hostname: 'api.elevenlabs.io',
+  port: 443,
+  agent: elevenLabsAgent,
+  // ✅ ИСПРАВЛЕНО: используем kebab-case endpoint (новый стандарт)
+  path: `/v1/convai/conversation/get-signed-url?agent_id=${AGENT_ID}`,
+  method: 'GET',
+  headers: {
+    'xi-api-key': ELEVENLABS_API_KEY,
+    'User-Agent': 'ElevenLabs-Voice-Chat/2.1',
+    'Accept': 'application/json',
+    'Content-Type': 'application/json'
+  },
+  timeout: 15000
+});
+
 function getSignedUrl() {
   return new Promise((resolve, reject) => {
-    const options = {
-      hostname: 'api.elevenlabs.io',
-      port: 443,
-      // ✅ ИСПРАВЛЕНО: используем kebab-case endpoint (новый стандарт)
-      path: `/v1/convai/conversation/get-signed-url?agent_id=${AGENT_ID}`,
-      method: 'GET',
-      headers: {
-        'xi-api-key': ELEVENLABS_API_KEY,
-        'User-Agent': 'ElevenLabs-Voice-Chat/2.1',
-        'Accept': 'application/json',
-        'Content-Type': 'application/json'
-      },
-      timeout: 15000
-    };
-
-    const req = https.request(options, (res) => {
-      let data = '';
+    const req = https.request(SIGNED_URL_REQUEST, (res) => {
+      const chunks = [];
       
       res.on('data', (chunk) => {
-        data += chunk;
+        chunks.push(chunk);
       });
       
       res.on('end', () => {
+        // Одна склейка и одно UTF-8 декодирование вместо конкатенации на каждый чанк
+        const data = Buffer.concat(chunks).toString('utf8');
         console.log(`📊 Signed URL response: ${res.statusCode}`);
-        console.log('Response headers:', res.headers);
+        if (VERBOSE_LOGS) {
+          console.log('Response headers:', res.headers);
+        }
         
         if (res.statusCode === 200) {
           try {
             const response = JSON.parse(data);
-            console.log('Signed URL response:', response);
+            if (VERBOSE_LOGS) {
+              console.log('Signed URL response:', response);
+            }
             if (response.signed_url) {
               resolve(response.signed_url);
             } else {
@@ -274,11 +353,11 @@ function getSignedUrl() {
             reject(new Error(`Parse error: ${error.message}`));
           }
         } else if (res.statusCode === 401) {
-          reject(new Error('Unauthorized - check API key'));
+          reject(new ElevenLabsError('Unauthorized - check API key', 'unauthorized'));
         } else if (res.statusCode === 404) {
-          reject(new Error('Agent not found or endpoint not found'));
+          reject(new ElevenLabsError('Agent not found or endpoint not found', 'agent_not_found'));
         } else if (res.statusCode === 429) {
-          reject(new Error('Rate limit exceeded'));
+          reject(new ElevenLabsError('Rate limit exceeded', 'rate_limited'));
         } else {
           let errorMsg = `API error: ${res.statusCode}`;
           try {
@@ -305,7 +384,7 @@ function getSignedUrl() {
     req.on('timeout', () => {
       console.error('⏰ Request timeout');
       req.destroy();
-      reject(new Error('Request timeout - ElevenLabs API not responding'));
+      reject(new ElevenLabsError('Request timeout - ElevenLabs API not responding', 'timeout'));
     });
 
     req.end();
@@ -313,7 +392,42 @@ function getSignedUrl() {
 }
 
 // ✅ HEALTH CHECK с подробной диагностикой
+// Интервалы и TTL считаются по монотонным часам (performance.now), Date — только для меток времени
+// Доступность ElevenLabs проверяется не на каждую пробу, а не чаще раза в минуту;
+// устаревший результат отдается сразу, а обновление идет в фоне
+const API_STATUS_TTL_MS = 60000;
+let apiStatus = null;
+
+const refreshApiStatus = singleFlight(async () => {
+  try {
+    await checkElevenLabsAPI();
+    apiStatus = { accessible: true, error: null, checkedAt: performance.now(), checkedAtIso: new Date().toISOString() };
+  } catch (error) {
+    apiStatus = { accessible: false, error: error.message, checkedAt: performance.now(), checkedAtIso: new Date().toISOString() };
+  }
+  return apiStatus;
+});
+
+function getApiStatus() {
+  if (!apiStatus) {
+    return refreshApiStatus();
+  }
+  if (performance.now() - apiStatus.checkedAt > API_STATUS_TTL_MS) {
+    refreshApiStatus();
+  }
+  return apiStatus;
+}
+
+// Готовый ответ кэшируется на секунду: частые пробы не пересобирают и не пересериализуют его
+const HEALTH_CACHE_TTL_MS = 1000;
+let healthCache = null;
+
 app.get('/health', async (req, res) => {
+  const now = performance.now();
+  if (healthCache && now - healthCache.createdAt < HEALTH_CACHE_TTL_MS) {
+    return res.status(healthCache.statusCode).type('json').send(healthCache.body);
+  }
+
   const health = {
     status: 'OK',
     timestamp: new Date().toISOString(),
@@ -325,37 +439,41 @@ app.get('/health', async (req, res) => {
     api_configured: !!ELEVENLABS_API_KEY
   };
 
-  try {
-    // Быстрая проверка доступности ElevenLabs API
-    await checkElevenLabsAPI();
-    health.elevenlabs_api = 'accessible';
-    health.agent_ready = true;
-  } catch (error) {
-    health.elevenlabs_api = 'error';
-    health.agent_ready = false;
-    health.api_error = error.message;
+  // Кэшированный статус ElevenLabs API (подробная проверка — /api/diagnostics)
+  const status = await getApiStatus();
+  health.elevenlabs_api = status.accessible ? 'accessible' : 'error';
+  health.agent_ready = status.accessible;
+  health.elevenlabs_checked_at = status.checkedAtIso;
+  if (!status.accessible) {
+    health.api_error = status.error;
   }
 
   const statusCode = health.elevenlabs_api === 'accessible' ? 200 : 503;
-  res.status(statusCode).json(health);
+  healthCache = {
+    createdAt: now,
+    statusCode,
+    body: JSON.stringify(health)
+  };
+  res.status(statusCode).type('json').send(healthCache.body);
 });
 
 // Quick API availability check
-function checkElevenLabsAPI() {
-  return new Promise((resolve, reject) => {
-    const options = {
-      hostname: 'api.elevenlabs.io',
-      port: 443,
-      path: '/v1/user',
-      method: 'GET',
-      headers: {
-        'xi-api-key': ELEVENLABS_API_KEY,
-        'User-Agent': 'ElevenLabs-Voice-Chat/2.1'
-      },
-      timeout: 5000
-    };
+const API_CHECK_REQUEST = Object.freeze({
+  hostname: 'api.elevenlabs.io',
+  port: 443,
+  agent: elevenLabsAgent,
+  path: '/v1/user',
+  method: 'GET',
+  headers: {
+    'xi-api-key': ELEVENLABS_API_KEY,
+    'User-Agent': 'ElevenLabs-Voice-Chat/2.1'
+  },
+  timeout: 5000
+});
 
-    const req = https.request(options, (res) => {
+function requestElevenLabsAPI() {
+  return new Promise((resolve, reject) => {
+    const req = https.request(API_CHECK_REQUEST, (res) => {
       if (res.statusCode === 200 || res.statusCode === 401) {
         // 200 = OK, 401 = API key issue but API is accessible
         resolve();
@@ -370,7 +488,7 @@ function checkElevenLabsAPI() {
     req.on('error', reject);
     req.on('timeout', () => {
       req.destroy();
-      reject(new Error('API timeout'));
+      reject(new ElevenLabsError('API timeout', 'timeout'));
     });
 
     req.end();
@@ -438,9 +556,16 @@ app.get('/api/diagnostics', async (req, res) => {
     tests: {}
   };
 
+  // Все три проверки независимы — запускаем их параллельно, разбираем по порядку
+  const [apiResult, agentResult, signedUrlResult] = await Promise.allSettled([
+    checkElevenLabsAPI(),
+    checkAgentExists(),
+    getSignedUrl()
+  ]);
+
   // Test 1: ElevenLabs API accessibility
   try {
-    await checkElevenLabsAPI();
+    settledValue(apiResult);
     diagnostics.elevenlabs = {
       status: 'accessible',
       message: 'API is responding',
@@ -461,7 +586,7 @@ app.get('/api/diagnostics', async (req, res) => {
 
   // Test 2: Agent existence and accessibility
   try {
-    const agentExists = await checkAgentExists();
+    const agentExists = settledValue(agentResult);
     if (agentExists) {
       diagnostics.agent = {
         status: 'found',
@@ -492,7 +617,7 @@ app.get('/api/diagnostics', async (req, res) => {
 
   // Test 3: Signed URL generation
   try {
-    const signedUrl = await getSignedUrl();
+    const signedUrl = settledValue(signedUrlResult);
     diagnostics.signed_url = {
       status: 'working',
       message: 'Can generate signed URLs',
@@ -535,13 +660,58 @@ app.get('/api/diagnostics', async (req, res) => {
   res.json(diagnostics);
 });
 
-// ✅ STATIC FILES
+// Значение результата Promise.allSettled; ошибка пробрасывается как при await
+function settledValue(result) {
+  if (result.status === 'rejected') {
+    throw result.reason;
+  }
+  return result.value;
+}
+
+// ✅ STATIC FILES: HTML страницы читаются с диска и сжимаются gzip один раз при старте
+// ETag считается один раз от содержимого, а не хэшированием тела на каждый запрос
+function loadHtmlPage(fileName) {
+  const raw = fs.readFileSync(path.join(__dirname, fileName));
+  const hash = crypto.createHash('sha1').update(raw).digest('base64url').slice(0, 16);
+  return {
+    raw,
+    gzip: zlib.gzipSync(raw, { level: zlib.constants.Z_BEST_COMPRESSION }),
+    etag: `"${hash}"`,
+    gzipEtag: `"${hash}-gz"`
+  };
+}
+
+const HTML_PAGES = {
+  index: loadHtmlPage('index.html'),
+  debug: loadHtmlPage('debug.html')
+};
+
+// Короткий max-age: после деплоя клиенты получат новую страницу через пару минут,
+// а повторные открытия до этого не ходят на сервер вовсе
+const HTML_CACHE_CONTROL = 'public, max-age=300';
+
+function sendHtmlPage(req, res, page) {
+  const html = HTML_PAGES[page];
+  res.vary('Accept-Encoding');
+  res.type('html');
+  res.set('Cache-Control', HTML_CACHE_CONTROL);
+
+  // res.send отвечает 304 сам, если ETag совпал с If-None-Match
+  if (req.acceptsEncodings('gzip')) {
+    res.set({ 'Content-Encoding': 'gzip', 'ETag': html.gzipEtag });
+    return res.send(html.gzip);
+  }
+
+  res.set('ETag', html.etag);
+  res.send(html.raw);
+}
+
 app.get('/', (req, res) => {
-  res.sendFile(path.join(__dirname, 'index.html'));
+  sendHtmlPage(req, res, 'index');
 });
 
 app.get('/debug', (req, res) => {
-  res.sendFile(path.join(__dirname, 'debug.html'));
+  sendHtmlPage(req, res, 'debug');
 });
 
 app.get('/favicon.ico', (req, res) => {
@@ -588,15 +758,37 @@ const server = app.listen(PORT, () => {
   console.log(`🔧 Debug: http://localhost:${PORT}/debug`);
   console.log(`🩺 Health: http://localhost:${PORT}/health`);
   
-  // Initial health check
-  setTimeout(async () => {
-    try {
-      await checkElevenLabsAPI();
-      console.log('✅ Initial ElevenLabs API check passed');
-    } catch (error) {
-      console.log(`⚠️ Initial ElevenLabs API check failed: ${error.message}`);
-    }
-  }, 1000);
+  // Initial health check + прогрев keep-alive соединений к ElevenLabs,
+  // чтобы первый пользователь не платил за DNS и TLS handshake
+  warmUpElevenLabs();
 });
 
+// Отключаем Nagle на входящих соединениях: мелкие JSON ответы уходят сразу
+server.on('connection', (socket) => {
+  socket.setNoDelay(true);
+});
+
+async function warmUpElevenLabs() {
+  const startedAt = performance.now();
+  // Первая проверка API заодно заполняет кэш статуса для /health
+  const [apiCheck, agentCheck] = await Promise.allSettled([
+    refreshApiStatus(),
+    checkAgentExists()
+  ]);
+
+  if (apiCheck.value.accessible) {
+    console.log('✅ Initial ElevenLabs API check passed');
+  } else {
+    console.log(`⚠️ Initial ElevenLabs API check failed: ${apiCheck.value.error}`);
+  }
+
+  if (agentCheck.status === 'fulfilled') {
+    console.log(`✅ Initial agent check: ${agentCheck.value ? 'found' : 'not found'}`);
+  } else {
+    console.log(`⚠️ Initial agent check failed: ${agentCheck.reason.message}`);
+  }
+
+  console.log(`🔥 ElevenLabs warm-up finished in ${Math.round(performance.now() - startedAt)}ms`);
+}
+
 module.exports = app;